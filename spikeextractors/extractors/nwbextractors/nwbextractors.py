@@ -1,3 +1,5 @@
+import queue
+import threading
 import uuid
 from datetime import datetime
 from collections import abc
@@ -6,6 +8,7 @@ import numpy as np
 import distutils.version
 from typing import Union, List, Optional
 import warnings
+from joblib import Parallel, delayed
 
 import spikeextractors as se
 from spikeextractors.extraction_tools import check_get_traces_args, check_get_unit_spike_train
@@ -17,13 +20,36 @@ try:
     from pynwb import NWBFile
     from pynwb.ecephys import ElectricalSeries, FilteredEphys, LFP
     from pynwb.ecephys import ElectrodeGroup
-    from hdmf.data_utils import DataChunkIterator
+    from hdmf.data_utils import DataChunkIterator, AbstractDataChunkIterator, DataChunk
     from hdmf.backends.hdf5.h5_utils import H5DataIO
+    from hdmf.common.table import VectorData
 
     HAVE_NWB = True
 except ModuleNotFoundError:
     HAVE_NWB = False
 
+try:
+    # registers the Blosc2 filter, needed to write and read Blosc2 compressed traces
+    import hdf5plugin
+
+    HAVE_HDF5PLUGIN = True
+except ModuleNotFoundError:
+    HAVE_HDF5PLUGIN = False
+
+try:
+    # if available, slicing of Blosc2 compressed datasets bypasses the HDF5 filter pipeline
+    import b2h5py.auto
+except ModuleNotFoundError:
+    pass
+
+try:
+    import zarr
+    import numcodecs
+
+    HAVE_ZARR = True
+except ModuleNotFoundError:
+    HAVE_ZARR = False
+
 PathType = Union[str, Path, None]
 ArrayType = Union[list, np.ndarray]
 
@@ -33,12 +59,14 @@ def check_nwb_install():
 
 
 def set_dynamic_table_property(dynamic_table, row_ids, property_name, values, index=False,
-                               default_value=np.nan, table=False, description='no description'):
+                               default_value=np.nan, table=False, description='no description', id_to_index=None):
     check_nwb_install()
     if not isinstance(row_ids, list) or not all(isinstance(x, (int, np.integer)) for x in row_ids):
         raise TypeError("'ids' must be a list of integers")
-    ids = list(dynamic_table.id[:])
-    if any([i not in ids for i in row_ids]):
+    if id_to_index is None:
+        # callers setting several properties can pass the {id: row index} map of the table, built once
+        id_to_index = {int(id): i for i, id in enumerate(dynamic_table.id[:])}
+    if any([i not in id_to_index for i in row_ids]):
         raise ValueError("'ids' contains values outside the range of existing ids")
     if not isinstance(property_name, str):
         raise TypeError("'property_name' must be a string")
@@ -48,11 +76,11 @@ def set_dynamic_table_property(dynamic_table, row_ids, property_name, values, in
     if index is False:
         if property_name in dynamic_table:
             for (row_id, value) in zip(row_ids, values):
-                dynamic_table[property_name].data[ids.index(row_id)] = value
+                dynamic_table[property_name].data[id_to_index[row_id]] = value
         else:
-            col_data = [default_value] * len(ids)  # init with default val
+            col_data = [default_value] * len(dynamic_table)  # init with default val
             for (row_id, value) in zip(row_ids, values):
-                col_data[ids.index(row_id)] = value
+                col_data[id_to_index[row_id]] = value
             dynamic_table.add_column(
                 name=property_name,
                 description=description,
@@ -78,21 +106,25 @@ def get_dynamic_table_property(dynamic_table, *, row_ids=None, property_name):
     all_row_ids = list(dynamic_table.id[:])
     if row_ids is None:
         row_ids = all_row_ids
-    return [dynamic_table[property_name][all_row_ids.index(x)] for x in row_ids]
+    id_to_index = {int(id): i for i, id in enumerate(all_row_ids)}
+    return [dynamic_table[property_name][id_to_index[x]] for x in row_ids]
+
 
+def get_nspikes(units_table, unit_id=None):
+    """
+    Return the number of spikes for chosen unit.
 
-def get_nspikes(units_table, unit_id):
-    """Return the number of spikes for chosen unit."""
+    If unit_id is None, return a {unit_id: number of spikes} dictionary of all units.
+    """
     check_nwb_install()
-    ids = np.array(units_table.id[:])
-    indexes = np.where(ids == unit_id)[0]
-    if not len(indexes):
+    ids = [int(id) for id in units_table.id[:]]
+    # the number of spikes of the units are the steps of the index of the flat spike_times
+    nspikes = dict(zip(ids, np.diff(np.asarray(units_table['spike_times_index'].data[:]), prepend=0)))
+    if unit_id is None:
+        return nspikes
+    if unit_id not in nspikes:
         raise ValueError(f"{unit_id} is an invalid unit_id. Valid ids: {ids}.")
-    index = indexes[0]
-    if index == 0:
-        return units_table['spike_times_index'].data[index]
-    else:
-        return units_table['spike_times_index'].data[index] - units_table['spike_times_index'].data[index - 1]
+    return nspikes[unit_id]
 
 
 def most_relevant_ch(traces: ArrayType):
@@ -106,15 +138,148 @@ def most_relevant_ch(traces: ArrayType):
     traces : ndarray
         ndarray of shape (nSpikes, nChannels, nSamples)
     """
-    n_channels = traces.shape[1]
-    avg = np.mean(traces, axis=0)
+    relevant_ch = int(np.argmax(np.ptp(np.mean(traces, axis=0), axis=1)))
+    return relevant_ch
+
+
+def get_unsigned_coercion(recording: se.RecordingExtractor):
+    """
+    Return the shift, in units of the channel gains, that maps the unscaled traces onto a signed data type.
+
+    NWB Schema v2.2.5 does not support channel offsets, so unsigned traces with offsets are stored as signed traces.
+    """
+    unsigned_coercion = recording.get_channel_offsets() / recording.get_channel_gains()
+    if not np.all([x.is_integer() for x in unsigned_coercion]):
+        raise NotImplementedError(
+            "Unable to coerce underlying unsigned data type to signed type, which is currently required for NWB "
+            "Schema v2.2.5! Please specify 'write_scaled=True'."
+        )
+    elif np.any(unsigned_coercion != 0):
+        warnings.warn(
+            "NWB Schema v2.2.5 does not officially support channel offsets. The data will be converted to a signed "
+            "type that does not use offsets."
+        )
+        unsigned_coercion = unsigned_coercion.astype(int)
+    return unsigned_coercion
 
-    max_min = np.zeros(n_channels)
-    for ch in range(n_channels):
-        max_min[ch] = avg[ch, :].max() - avg[ch, :].min()
 
-    relevant_ch = np.argmax(max_min)
-    return relevant_ch
+def get_chunk_frames(num_frames: int, num_channels: int):
+    """
+    Return the number of frames of the chunks in which traces are written.
+
+    The traces are chunked along time with all channels in each chunk (~1M samples per chunk), so that
+    chunks are written sequentially and align with the [start_frame:end_frame, :] reads of get_traces.
+    """
+    return min(max(1, 1000000 // num_channels), num_frames)
+
+
+def get_traces_chunk(recording: se.RecordingExtractor, start_frame: int, end_frame: int,
+                     unsigned_coercion: np.ndarray, write_scaled: bool, dtype: str = None):
+    """
+    Return the traces between start_frame and end_frame with time as zero axis (the nwb standard).
+
+    If dtype is given, float traces are quantized to dtype in steps of the channel gains.
+    """
+    data = recording.get_traces(start_frame=start_frame, end_frame=end_frame, return_scaled=write_scaled)
+    if dtype is not None and data.dtype.kind == 'f':
+        if write_scaled:
+            # (scaled - offset) / gain + offset / gain
+            data = data / recording.get_channel_gains()[:, None]
+        else:
+            data = data + unsigned_coercion[:, None]
+        data = np.round(data)
+        dtype_info = np.iinfo(dtype)
+        if np.any(data < dtype_info.min) or np.any(data > dtype_info.max):
+            raise ValueError(f"The quantized traces exceed the range of '{dtype}'. "
+                             "Please specify a wider 'dtype' or larger channel gains.")
+        data = data.astype(dtype)
+    elif not write_scaled:
+        data_dtype_name = data.dtype.name
+        if data_dtype_name.startswith("uint"):
+            data_dtype_name = data_dtype_name[1:]  # Retain memory of signed data type
+        data = data + unsigned_coercion[:, None]
+        data = data.astype(data_dtype_name)
+    return data.T
+
+
+def iter_traces_chunks(recording: se.RecordingExtractor, chunk_frames: int, unsigned_coercion: np.ndarray,
+                       write_scaled: bool, dtype: str = None):
+    """
+    Yield the traces of the recording in DataChunks of chunk_frames frames and all channels.
+
+    The chunks are read by a background thread, so that reading the next chunk overlaps with the
+    compression and writing of the current one (both release the GIL). The thread starts with the first
+    chunk requested, and is stopped when the generator is closed.
+    """
+    num_frames = recording.get_num_frames()
+    chunks = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def read_chunks():
+        try:
+            for start_frame in range(0, num_frames, chunk_frames):
+                if stop.is_set():
+                    return
+                end_frame = min(start_frame + chunk_frames, num_frames)
+                data = get_traces_chunk(recording, start_frame, end_frame, unsigned_coercion, write_scaled, dtype)
+                chunks.put(DataChunk(data=data, selection=np.s_[start_frame:end_frame, :]))
+        except Exception as e:
+            chunks.put(e)
+        else:
+            chunks.put(None)
+
+    reader = threading.Thread(target=read_chunks, daemon=True)
+    reader.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # unblock the reader if the chunks are not all consumed
+        stop.set()
+        while not chunks.empty():
+            chunks.get_nowait()
+        reader.join()
+
+
+class TracesChunkIterator(AbstractDataChunkIterator if HAVE_NWB else object):
+    """Iterate over the traces of a recording in (chunk_frames, num_channels) DataChunks."""
+
+    def __init__(self, recording: se.RecordingExtractor, chunk_frames: int, unsigned_coercion: np.ndarray,
+                 write_scaled: bool, dtype: str = None):
+        self._num_frames = recording.get_num_frames()
+        self._num_channels = recording.get_num_channels()
+        self._chunk_frames = chunk_frames
+        self._dtype = get_traces_chunk(recording, 0, 1, unsigned_coercion, write_scaled, dtype).dtype
+        self._data = iter_traces_chunks(recording, chunk_frames, unsigned_coercion, write_scaled, dtype)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._data)
+
+    def close(self):
+        """Stop reading chunks."""
+        self._data.close()
+
+    def recommended_chunk_shape(self):
+        return self._chunk_frames, self._num_channels
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return self._num_frames, self._num_channels
 
 
 def update_dict(d: dict, u: dict):
@@ -174,6 +339,12 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         """
         Load an NWBFile as a RecordingExtractor.
 
+        The file is kept open (read-only) until close() is called or the extractor is deleted. Use the
+        extractor as a context manager to release the file, e.g. before overwriting it:
+
+            with NwbRecordingExtractor(file_path) as recording:
+                ...
+
         Parameters
         ----------
         file_path: path to NWB file
@@ -182,96 +353,101 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         assert self.installed, self.installation_mesg
         se.RecordingExtractor.__init__(self)
         self._path = str(file_path)
-        with NWBHDF5IO(self._path, 'r') as io:
-            nwbfile = io.read()
-            if electrical_series_name is not None:
-                self._electrical_series_name = electrical_series_name
-            else:
-                a_names = list(nwbfile.acquisition)
-                if len(a_names) > 1:
-                    raise ValueError("More than one acquisition found! You must specify 'electrical_series_name'.")
-                if len(a_names) == 0:
-                    raise ValueError("No acquisitions found in the .nwb file.")
-                self._electrical_series_name = a_names[0]
-            es = nwbfile.acquisition[self._electrical_series_name]
-            if hasattr(es, 'timestamps') and es.timestamps:
-                self.sampling_frequency = 1. / np.median(np.diff(es.timestamps))
-                self.recording_start_time = es.timestamps[0]
+        # the file is kept open for the lifetime of the extractor, so that accessing traces only reads the data
+        self._io = NWBHDF5IO(self._path, 'r')
+        nwbfile = self._io.read()
+        self._nwbfile = nwbfile
+        if electrical_series_name is not None:
+            self._electrical_series_name = electrical_series_name
+        else:
+            a_names = list(nwbfile.acquisition)
+            if len(a_names) > 1:
+                raise ValueError("More than one acquisition found! You must specify 'electrical_series_name'.")
+            if len(a_names) == 0:
+                raise ValueError("No acquisitions found in the .nwb file.")
+            self._electrical_series_name = a_names[0]
+        es = nwbfile.acquisition[self._electrical_series_name]
+        self._es = es
+        self._es_data = es.data
+        if hasattr(es, 'timestamps') and es.timestamps:
+            self.sampling_frequency = 1. / np.median(np.diff(es.timestamps))
+            self.recording_start_time = es.timestamps[0]
+        else:
+            self.sampling_frequency = es.rate
+            if hasattr(es, 'starting_time'):
+                self.recording_start_time = es.starting_time
             else:
-                self.sampling_frequency = es.rate
-                if hasattr(es, 'starting_time'):
-                    self.recording_start_time = es.starting_time
-                else:
-                    self.recording_start_time = 0.
+                self.recording_start_time = 0.
 
-            self.num_frames = int(es.data.shape[0])
-            num_channels = len(es.electrodes.data)
+        self.num_frames = int(es.data.shape[0])
+        num_channels = len(es.electrodes.data)
 
-            # Channels gains - for RecordingExtractor, these are values to cast traces to uV
-            if es.channel_conversion is not None:
-                gains = es.conversion * es.channel_conversion[:] * 1e6
+        # Channels gains - for RecordingExtractor, these are values to cast traces to uV
+        if es.channel_conversion is not None:
+            gains = es.conversion * es.channel_conversion[:] * 1e6
+        else:
+            gains = es.conversion * np.ones(num_channels) * 1e6
+        # Extractors channel groups must be integers, but Nwb electrodes group_name can be strings
+        if 'group_name' in nwbfile.electrodes.colnames:
+            unique_grp_names = list(np.unique(nwbfile.electrodes['group_name'][:]))
+
+        # Fill channel properties dictionary from electrodes table
+        electrode_table_indices = es.electrodes.data[:]
+        electrode_table_ids = es.electrodes.table.id[:]
+        self.channel_ids = [electrode_table_ids[x] for x in electrode_table_indices]
+        self._channel_id_to_ind = {id: ind for ind, id in enumerate(self.channel_ids)}
+        self._channel_inds_cache = dict()
+
+        # If gains are not 1, set has_scaled to True
+        if np.any(gains != 1):
+            self.set_channel_gains(gains)
+            self.has_unscaled = True
+
+        # Set the key properties (locations, groups, offsets) of all channels from the electrodes table columns
+        electrodes_columns = {col: nwbfile.electrodes[col][:] for col in nwbfile.electrodes.colnames}
+        if 'rel_x' in electrodes_columns:
+            rel_x = np.asarray(electrodes_columns['rel_x'])[electrode_table_indices]
+            if 'rel_y' in electrodes_columns:
+                rel_y = np.asarray(electrodes_columns['rel_y'])[electrode_table_indices]
             else:
-                gains = es.conversion * np.ones(num_channels) * 1e6
-            # Extractors channel groups must be integers, but Nwb electrodes group_name can be strings
-            if 'group_name' in nwbfile.electrodes.colnames:
-                unique_grp_names = list(np.unique(nwbfile.electrodes['group_name'][:]))
-
-            # Fill channel properties dictionary from electrodes table
-            self.channel_ids = [es.electrodes.table.id[x] for x in es.electrodes.data]
-
-            # If gains are not 1, set has_scaled to True
-            if np.any(gains != 1):
-                self.set_channel_gains(gains)
-                self.has_unscaled = True
-
-            for es_ind, (channel_id, electrode_table_index) in enumerate(zip(self.channel_ids, es.electrodes.data)):
-                this_loc = []
-                if 'rel_x' in nwbfile.electrodes:
-                    this_loc.append(nwbfile.electrodes['rel_x'][electrode_table_index])
-                    if 'rel_y' in nwbfile.electrodes:
-                        this_loc.append(nwbfile.electrodes['rel_y'][electrode_table_index])
-                    else:
-                        this_loc.append(0)
-                    self.set_channel_locations(this_loc, channel_id)
-
-                for col in nwbfile.electrodes.colnames:
-                    if isinstance(nwbfile.electrodes[col][electrode_table_index], ElectrodeGroup):
-                        continue
-                    elif col == 'group_name':
-                        self.set_channel_groups(
-                            int(unique_grp_names.index(nwbfile.electrodes[col][electrode_table_index])), channel_id)
-                    elif col == 'location':
-                        self.set_channel_property(channel_id, 'brain_area',
-                                                  nwbfile.electrodes[col][electrode_table_index])
-                    elif col == 'offset':
-                        self.set_channel_offsets(channel_ids=channel_id,
-                                                 offsets=nwbfile.electrodes[col][electrode_table_index])
-                    elif col in ['x', 'y', 'z', 'rel_x', 'rel_y']:
-                        continue
-                    else:
-                        self.set_channel_property(channel_id, col, nwbfile.electrodes[col][electrode_table_index])
-
-            # Fill epochs dictionary
-            self._epochs = {}
-            if nwbfile.epochs is not None:
-                df_epochs = nwbfile.epochs.to_dataframe()
-
-                if 'tags' in df_epochs:
-                    tags_or_label = 'tags'  # older nwb schema version
-                else:
-                    tags_or_label = 'label'
-
-                self._epochs = {
-                    row[tags_or_label][0]: {
-                        'start_frame': self.time_to_frame(row['start_time']),
-                        'end_frame': self.time_to_frame(row['stop_time'])
-                    }
-                    for _, row in df_epochs.iterrows()
+                rel_y = np.zeros(len(rel_x))
+            self.set_channel_locations(np.stack([rel_x, rel_y], axis=1))
+
+        for col, col_values in electrodes_columns.items():
+            if isinstance(col_values[0], ElectrodeGroup) or col in ['x', 'y', 'z', 'rel_x', 'rel_y']:
+                continue
+            channel_values = [col_values[electrode_table_index] for electrode_table_index in electrode_table_indices]
+            if col == 'group_name':
+                self.set_channel_groups([int(unique_grp_names.index(grp_name)) for grp_name in channel_values])
+            elif col == 'offset':
+                self.set_channel_offsets(offsets=[float(offset) for offset in channel_values])
+            else:
+                property_name = 'brain_area' if col == 'location' else col
+                for channel_id, value in zip(self.channel_ids, channel_values):
+                    self.set_channel_property(channel_id, property_name, value)
+
+        # Fill epochs dictionary
+        self._epochs = {}
+        if nwbfile.epochs is not None:
+            if 'tags' in nwbfile.epochs.colnames:
+                tags_or_label = 'tags'  # older nwb schema version
+            else:
+                tags_or_label = 'label'
+
+            # convert the start and stop times of all epochs to frames
+            start_frames = self.time_to_frame(np.asarray(nwbfile.epochs['start_time'][:]))
+            end_frames = self.time_to_frame(np.asarray(nwbfile.epochs['stop_time'][:]))
+            self._epochs = {
+                tags[0]: {
+                    'start_frame': start_frame,
+                    'end_frame': end_frame
                 }
+                for tags, start_frame, end_frame in zip(nwbfile.epochs[tags_or_label][:], start_frames, end_frames)
+            }
 
-            self._kwargs = {'file_path': str(Path(file_path).absolute()),
-                            'electrical_series_name': electrical_series_name}
-            self.make_nwb_metadata(nwbfile=nwbfile, es=es)
+        self._kwargs = {'file_path': str(Path(file_path).absolute()),
+                        'electrical_series_name': electrical_series_name}
+        self.make_nwb_metadata(nwbfile=nwbfile, es=es)
 
     def make_nwb_metadata(self, nwbfile, es):
         # Metadata dictionary - useful for constructing a nwb file
@@ -311,26 +487,74 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         end_frame: int = None,
         return_scaled: bool = True
     ):
-        with NWBHDF5IO(self._path, 'r') as io:
-            nwbfile = io.read()
-            es = nwbfile.acquisition[self._electrical_series_name]
-            es_channel_ids = np.array(es.electrodes.table.id[:])[es.electrodes.data[:]].tolist()
-            channel_inds = [es_channel_ids.index(id) for id in channel_ids]
-            if np.array(channel_ids).size > 1 and np.any(np.diff(channel_ids) < 0):
-                # get around h5py constraint that it does not allow datasets
-                # to be indexed out of order
-                sorted_channel_ids = np.sort(channel_ids)
-                sorted_idx = np.array([list(sorted_channel_ids).index(ch) for ch in channel_ids])
-                recordings = es.data[start_frame:end_frame, sorted_channel_ids].T
-                traces = recordings[sorted_idx, :]
+        if len(channel_ids) == 0:
+            return np.empty((0, end_frame - start_frame), dtype=self._es_data.dtype)
+        channel_inds, sorted_inds, inverse_order = self._get_channel_inds(channel_ids)
+        cmin, cmax = sorted_inds[0], sorted_inds[-1]
+        if cmax - cmin + 1 <= 2 * len(channel_inds):
+            # h5py fancy indexing issues one small selection per channel: when the requested channels are dense,
+            # reading the contiguous span of channels at once and reindexing in memory is much faster
+            recordings = np.empty((end_frame - start_frame, cmax - cmin + 1), dtype=self._es_data.dtype)
+            self._es_data.read_direct(recordings, source_sel=np.s_[start_frame:end_frame, cmin:cmax + 1])
+            if np.array_equal(channel_inds, np.arange(cmin, cmax + 1)):
+                # the buffer already holds the requested channels in order: return its transposed view
+                traces = recordings.T
             else:
-                traces = es.data[start_frame:end_frame, channel_inds].T
-            # This DatasetView and lazy operations will only work within context
-            # We're keeping the non-lazy version for now
-            # es_view = DatasetView(es.data)  # es is an instantiated h5py dataset
-            # traces = es_view.lazy_slice[start_frame:end_frame, channel_ids].lazy_transpose()
+                traces = recordings[:, channel_inds - cmin].T
+        else:
+            # get around h5py constraint that it does not allow datasets
+            # to be indexed out of order
+            recordings = np.empty((end_frame - start_frame, len(channel_inds)), dtype=self._es_data.dtype)
+            self._es_data.read_direct(recordings, source_sel=np.s_[start_frame:end_frame, sorted_inds])
+            traces = recordings[:, inverse_order].T
         return traces
 
+    def _get_channel_inds(self, channel_ids):
+        """
+        Return the indices of channel_ids in the traces dataset, the sorted indices and the permutation that
+        restores the order of channel_ids from the sorted indices.
+
+        The result is memoized, as get_traces is typically called over many time windows with the same channels.
+        """
+        key = tuple(channel_ids)
+        if key not in self._channel_inds_cache:
+            channel_inds = np.array([self._channel_id_to_ind[id] for id in channel_ids])
+            sorted_order = np.argsort(channel_inds)
+            self._channel_inds_cache[key] = (channel_inds, channel_inds[sorted_order], np.argsort(sorted_order))
+        return self._channel_inds_cache[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+        # the extractor can be partially built, e.g. if unpickling failed
+        if hasattr(self, '_memmap_files'):
+            se.RecordingExtractor.__del__(self)
+
+    def __getstate__(self):
+        # the h5py objects cannot be pickled: they are reopened from the file path when unpickling
+        state = self.__dict__.copy()
+        for key in ['_io', '_nwbfile', '_es', '_es_data']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._io = NWBHDF5IO(self._kwargs['file_path'], 'r')
+        self._nwbfile = self._io.read()
+        self._es = self._nwbfile.acquisition[self._electrical_series_name]
+        self._es_data = self._es.data
+
+    def close(self):
+        """Close the NWB file kept open by the extractor."""
+        if getattr(self, '_io', None) is not None:
+            self._io.close()
+            self._io = None
+
     def get_sampling_frequency(self):
         return self.sampling_frequency
 
@@ -639,21 +863,25 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         # property 'offset' should not be in the NWB electrodes_table as not officially supported by schema v2.2.5
         channel_prop_names = set(recording.get_shared_channel_property_names()) - set(nwbfile.electrodes.colnames) \
                              - {'gain', 'location', 'offset'}
+        # each property is set for all channels with one table update
+        channel_ids = recording.get_channel_ids()
+        electrode_id_to_index = {int(id): i for i, id in enumerate(nwbfile.electrodes.id[:])}
         for channel_prop_name in channel_prop_names:
-            for channel_id in recording.get_channel_ids():
-                val = recording.get_channel_property(channel_id, channel_prop_name)
-                descr = 'no description'
-                if channel_prop_name == 'brain_area':
-                    channel_prop_name = 'location'
-                    descr = 'brain area location'
-                set_dynamic_table_property(
-                    dynamic_table=nwbfile.electrodes,
-                    row_ids=[int(channel_id)],
-                    property_name=channel_prop_name,
-                    values=[val],
-                    default_value=np.nan,
-                    description=descr
-                )
+            values = [recording.get_channel_property(channel_id, channel_prop_name) for channel_id in channel_ids]
+            property_name = channel_prop_name
+            descr = 'no description'
+            if channel_prop_name == 'brain_area':
+                property_name = 'location'
+                descr = 'brain area location'
+            set_dynamic_table_property(
+                dynamic_table=nwbfile.electrodes,
+                row_ids=[int(channel_id) for channel_id in channel_ids],
+                property_name=property_name,
+                values=values,
+                default_value=np.nan,
+                description=descr,
+                id_to_index=electrode_id_to_index
+            )
 
     @staticmethod
     def add_electrical_series(
@@ -664,7 +892,9 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         use_times: bool = False,
         write_as: str = 'raw',
         es_key: str = None,
-        write_scaled: bool = False
+        write_scaled: bool = False,
+        compression: str = 'gzip',
+        dtype: str = None
     ):
         """
         Auxiliary static method for nwbextractor.
@@ -696,6 +926,17 @@ class NwbRecordingExtractor(se.RecordingExtractor):
             Key in metadata dictionary containing metadata info for the specific electrical series
         write_scaled: bool (optional, defaults to True)
             If True, writes the scaled traces (return_scaled=True)
+        compression: str (optional, defaults to 'gzip')
+            Compression of the traces data. Options:
+            - 'gzip' uses the standard HDF5 gzip filter
+            - 'blosc2' uses Blosc2 (zstd with bitshuffle), which is faster and compresses int16 traces better,
+              but requires hdf5plugin to write and read the file (pip install hdf5plugin).
+              Installing b2h5py further speeds up reading of Blosc2 compressed traces.
+        dtype: str (optional)
+            Signed integer type (e.g. 'int16') to quantize float traces to, in steps of the channel gains,
+            which are then written as conversion factors. This halves (float32) or quarters (float64) the size
+            of the traces, at the cost of a resolution of one gain. Integer traces are always written unchanged.
+            A ValueError is raised if the quantized traces do not fit in dtype.
 
         Missing keys in an element of metadata['Ecephys']['ElectrodeGroup'] will be auto-populated with defaults
         whenever possible.
@@ -710,6 +951,12 @@ class NwbRecordingExtractor(se.RecordingExtractor):
 
         assert write_as in ['raw', 'processed', 'lfp'], \
             f"'write_as' should be 'raw', 'processed' or 'lfp', but intead received value {write_as}"
+        assert compression in ['gzip', 'blosc2'], \
+            f"'compression' should be 'gzip' or 'blosc2', but instead received value {compression}"
+        if compression == 'blosc2':
+            assert HAVE_HDF5PLUGIN, "To use 'blosc2' compression, install hdf5plugin: \n\n pip install hdf5plugin\n\n"
+        assert dtype is None or np.dtype(dtype).kind == 'i', \
+            f"'dtype' should be a signed integer type, but instead received value {dtype}"
 
         if write_as == 'raw':
             eseries_kwargs = dict(
@@ -776,19 +1023,10 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         # To get traces in Volts we take data*channel_conversion*conversion.
         channel_conversion = recording.get_channel_gains()
         channel_offset = recording.get_channel_offsets()
-        unsigned_coercion = channel_offset / channel_conversion
-        if not np.all([x.is_integer() for x in unsigned_coercion]):
-            raise NotImplementedError(
-                "Unable to coerce underlying unsigned data type to signed type, which is currently required for NWB "
-                "Schema v2.2.5! Please specify 'write_scaled=True'."
-            )
-        elif np.any(unsigned_coercion != 0):
-            warnings.warn(
-                "NWB Schema v2.2.5 does not officially support channel offsets. The data will be converted to a signed "
-                "type that does not use offsets."
-            )
-            unsigned_coercion = unsigned_coercion.astype(int)
-        if write_scaled:
+        unsigned_coercion = get_unsigned_coercion(recording)
+        # float traces quantized to dtype are stored unscaled
+        quantize = dtype is not None and recording.get_traces(end_frame=1, return_scaled=write_scaled).dtype.kind == 'f'
+        if write_scaled and not quantize:
             eseries_kwargs.update(conversion=1e-6)
         else:
             if len(np.unique(channel_conversion)) == 1:  # if all gains are equal
@@ -797,37 +1035,36 @@ class NwbRecordingExtractor(se.RecordingExtractor):
                 eseries_kwargs.update(conversion=1e-6)
                 eseries_kwargs.update(channel_conversion=channel_conversion)
 
+        num_frames = recording.get_num_frames()
+        num_channels = recording.get_num_channels()
+        chunk_frames = get_chunk_frames(num_frames, num_channels)
+        chunk_shape = (chunk_frames, num_channels)
+
         if isinstance(recording.get_traces(end_frame=5, return_scaled=write_scaled), np.memmap) \
-                and np.all(channel_offset == 0):
+                and np.all(channel_offset == 0) and not quantize:
             n_bytes = np.dtype(recording.get_dtype()).itemsize
-            buffer_size = int(buffer_mb * 1e6) // (recording.get_num_channels() * n_bytes)
+            buffer_size = int(buffer_mb * 1e6) // (num_channels * n_bytes)
             ephys_data = DataChunkIterator(
                 data=recording.get_traces(return_scaled=write_scaled).T,  # nwb standard is time as zero axis
                 buffer_size=buffer_size
             )
         else:
-            def data_generator(recording, channels_ids, unsigned_coercion, write_scaled):
-                for i, ch in enumerate(channels_ids):
-                    data = recording.get_traces(channel_ids=[ch], return_scaled=write_scaled)
-                    if not write_scaled:
-                        data_dtype_name = data.dtype.name
-                        if data_dtype_name.startswith("uint"):
-                            data_dtype_name = data_dtype_name[1:]  # Retain memory of signed data type
-                        data = data + unsigned_coercion[i]
-                        data = data.astype(data_dtype_name)
-                    yield data.flatten()
-            ephys_data = DataChunkIterator(
-                data=data_generator(
-                    recording=recording,
-                    channels_ids=channel_ids,
-                    unsigned_coercion=unsigned_coercion,
-                    write_scaled=write_scaled
-                ),
-                iter_axis=1,  # nwb standard is time as zero axis
-                maxshape=(recording.get_num_frames(), recording.get_num_channels())
+            ephys_data = TracesChunkIterator(
+                recording=recording,
+                chunk_frames=chunk_frames,
+                unsigned_coercion=unsigned_coercion,
+                write_scaled=write_scaled,
+                dtype=dtype
             )
 
-        eseries_kwargs.update(data=H5DataIO(ephys_data, compression="gzip"))
+        if compression == 'blosc2':
+            compression_kwargs = dict(
+                hdf5plugin.Blosc2(cname='zstd', clevel=3, filters=hdf5plugin.Blosc2.BITSHUFFLE),
+                allow_plugin_filters=True
+            )
+        else:
+            compression_kwargs = dict(compression="gzip")
+        eseries_kwargs.update(data=H5DataIO(ephys_data, chunks=chunk_shape, **compression_kwargs))
         if not use_times:
             eseries_kwargs.update(
                 starting_time=recording.frame_to_time(0),
@@ -901,7 +1138,9 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         metadata: dict = None,
         write_as: str = 'raw',
         es_key: str = None,
-        write_scaled: bool = False
+        write_scaled: bool = False,
+        compression: str = 'gzip',
+        dtype: str = None
     ):
         """
         Auxiliary static method for nwbextractor.
@@ -932,6 +1171,10 @@ class NwbRecordingExtractor(se.RecordingExtractor):
             Key in metadata dictionary containing metadata info for the specific electrical series
         write_scaled: bool (optional, defaults to True)
             If True, writes the scaled traces (return_scaled=True)
+        compression: str (optional, defaults to 'gzip')
+            Compression of the traces data: 'gzip' or 'blosc2' (requires hdf5plugin)
+        dtype: str (optional)
+            If given (e.g. 'int16'), float traces are quantized to this integer type (see add_electrical_series)
         """
         if nwbfile is not None:
             assert isinstance(nwbfile, NWBFile), "'nwbfile' should be of type pynwb.NWBFile"
@@ -961,7 +1204,9 @@ class NwbRecordingExtractor(se.RecordingExtractor):
             metadata=metadata,
             write_as=write_as,
             es_key=es_key,
-            write_scaled=write_scaled
+            write_scaled=write_scaled,
+            compression=compression,
+            dtype=dtype
         )
         se.NwbRecordingExtractor.add_epochs(
             recording=recording,
@@ -980,7 +1225,9 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         metadata: dict = None,
         write_as: str = 'raw',
         es_key: str = None,
-        write_scaled: bool = False
+        write_scaled: bool = False,
+        compression: str = 'gzip',
+        dtype: str = None
     ):
         """
         Primary method for writing a RecordingExtractor object to an NWBFile.
@@ -1031,6 +1278,13 @@ class NwbRecordingExtractor(se.RecordingExtractor):
             Key in metadata dictionary containing metadata info for the specific electrical series
         write_scaled: bool (optional, defaults to True)
             If True, writes the scaled traces (return_scaled=True)
+        compression: str (optional, defaults to 'gzip')
+            Compression of the traces data: 'gzip' or 'blosc2' (requires hdf5plugin)
+        dtype: str (optional)
+            If given (e.g. 'int16'), float traces are quantized to this integer type (see add_electrical_series)
+
+        If save_path ends with '.zarr', only the traces are written, to a Zarr store (see write_recording_zarr), and
+        the metadata, buffer_mb, use_times, write_as, es_key and compression arguments are ignored.
         """
         assert HAVE_NWB, NwbRecordingExtractor.installation_mesg
 
@@ -1043,6 +1297,29 @@ class NwbRecordingExtractor(se.RecordingExtractor):
         assert save_path is None or nwbfile is None, \
             "Either pass a save_path location, or nwbfile object, but not both!"
 
+        if save_path is not None and Path(save_path).suffix == '.zarr':
+            ignored_args = dict(
+                metadata=metadata is not None,
+                buffer_mb=buffer_mb != 500,
+                use_times=use_times,
+                write_as=write_as != 'raw',
+                es_key=es_key is not None,
+                compression=compression != 'gzip'
+            )
+            if any(ignored_args.values()):
+                warnings.warn(
+                    "Only the traces are written to Zarr stores: the arguments "
+                    f"{[name for name, is_set in ignored_args.items() if is_set]} are ignored."
+                )
+            se.NwbRecordingExtractor.write_recording_zarr(
+                recording=recording,
+                save_path=save_path,
+                overwrite=overwrite,
+                write_scaled=write_scaled,
+                dtype=dtype
+            )
+            return
+
         # Update any previous metadata with user passed dictionary
         if hasattr(recording, 'nwb_metadata'):
             metadata = update_dict(recording.nwb_metadata, metadata)
@@ -1079,7 +1356,9 @@ class NwbRecordingExtractor(se.RecordingExtractor):
                     use_times=use_times,
                     write_as=write_as,
                     es_key=es_key,
-                    write_scaled=write_scaled
+                    write_scaled=write_scaled,
+                    compression=compression,
+                    dtype=dtype
                 )
 
                 # Write to file
@@ -1093,9 +1372,89 @@ class NwbRecordingExtractor(se.RecordingExtractor):
                 metadata=metadata,
                 write_as=write_as,
                 es_key=es_key,
-                write_scaled=write_scaled
+                write_scaled=write_scaled,
+                compression=compression,
+                dtype=dtype
             )
 
+    @staticmethod
+    def write_recording_zarr(
+        recording: se.RecordingExtractor,
+        save_path: PathType,
+        overwrite: bool = False,
+        write_scaled: bool = False,
+        dtype: str = None,
+        n_jobs: int = 1
+    ):
+        """
+        Write the traces of a RecordingExtractor object to a Zarr store, following the NWB layout of an acquired
+        ElectricalSeries ('acquisition/ElectricalSeries_raw/data', with time as zero axis).
+
+        Each Zarr chunk is an independent file: the traces are compressed (Blosc zstd with bitshuffle) and
+        can be written in parallel threads (n_jobs), which is much faster than write_recording for long recordings.
+        The sampling rate, starting time, conversion and electrode ids are stored as attributes
+        of the ElectricalSeries group. The store is not an NWBFile and cannot be loaded by NwbRecordingExtractor.
+
+        Parameters
+        ----------
+        recording: RecordingExtractor
+        save_path: PathType
+            Path of the Zarr store
+        overwrite: bool
+            Whether or not to overwrite the Zarr store if it already exists.
+        write_scaled: bool (optional, defaults to False)
+            If True, writes the scaled traces (return_scaled=True)
+        dtype: str (optional)
+            If given (e.g. 'int16'), float traces are quantized to this integer type (see add_electrical_series)
+        n_jobs: int (optional, defaults to 1)
+            Number of threads writing chunks. If -1, all cores are used. The threads call recording.get_traces
+            concurrently: use n_jobs > 1 only with thread-safe recording extractors.
+        """
+        assert HAVE_ZARR, "To write Zarr stores, install zarr: \n\n pip install zarr\n\n"
+        assert dtype is None or np.dtype(dtype).kind == 'i', \
+            f"'dtype' should be a signed integer type, but instead received value {dtype}"
+
+        num_frames = recording.get_num_frames()
+        num_channels = recording.get_num_channels()
+        chunk_frames = get_chunk_frames(num_frames, num_channels)
+        channel_conversion = recording.get_channel_gains()
+        unsigned_coercion = get_unsigned_coercion(recording)
+        first_frame = get_traces_chunk(recording, 0, 1, unsigned_coercion, write_scaled, dtype)
+        quantize = dtype is not None and recording.get_traces(end_frame=1, return_scaled=write_scaled).dtype.kind == 'f'
+
+        root = zarr.open(str(save_path), mode='w' if overwrite else 'w-')
+        es_group = root.create_group('acquisition/ElectricalSeries_raw')
+        data = es_group.create_dataset(
+            'data',
+            shape=(num_frames, num_channels),
+            chunks=(chunk_frames, num_channels),
+            dtype=first_frame.dtype,
+            compressor=numcodecs.Blosc(cname='zstd', clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE)
+        )
+
+        def write_chunk(start_frame):
+            end_frame = min(start_frame + chunk_frames, num_frames)
+            data[start_frame:end_frame] = get_traces_chunk(recording, start_frame, end_frame, unsigned_coercion,
+                                                           write_scaled, dtype)
+
+        # Blosc releases the GIL, so that chunks are compressed concurrently by threads
+        Parallel(n_jobs=n_jobs, backend='threading')(
+            delayed(write_chunk)(start_frame) for start_frame in range(0, num_frames, chunk_frames)
+        )
+
+        es_attrs = dict(
+            rate=float(recording.get_sampling_frequency()),
+            starting_time=float(recording.frame_to_time(0)),
+            electrodes=[int(channel_id) for channel_id in recording.get_channel_ids()]
+        )
+        if write_scaled and not quantize:
+            es_attrs.update(conversion=1e-6)
+        elif len(np.unique(channel_conversion)) == 1:  # if all gains are equal
+            es_attrs.update(conversion=float(channel_conversion[0]) * 1e-6)
+        else:
+            es_attrs.update(conversion=1e-6, channel_conversion=channel_conversion.tolist())
+        es_group.attrs.update(es_attrs)
+
     @staticmethod
     def get_nwb_metadata(recording: se.RecordingExtractor, metadata: dict = None):
         """
@@ -1138,6 +1497,9 @@ class NwbSortingExtractor(se.SortingExtractor):
 
     def __init__(self, file_path, electrical_series=None, sampling_frequency=None):
         """
+        The file is kept open (read-only) until close() is called or the extractor is deleted. Use the
+        extractor as a context manager to release the file, e.g. before overwriting it.
+
         Parameters
         ----------
         path: path to NWB file
@@ -1146,64 +1508,80 @@ class NwbSortingExtractor(se.SortingExtractor):
         assert self.installed, self.installation_mesg
         se.SortingExtractor.__init__(self)
         self._path = str(file_path)
-        with NWBHDF5IO(self._path, 'r') as io:
-            nwbfile = io.read()
-            if sampling_frequency is None:
-                # defines the electrical series from where the sorting came from
-                # important to know the sampling_frequency
-                if electrical_series is None:
-                    if len(nwbfile.acquisition) > 1:
-                        raise Exception('More than one acquisition found. You must specify electrical_series.')
-                    if len(nwbfile.acquisition) == 0:
-                        raise Exception("No acquisitions found in the .nwb file from which to read sampling frequency. \
-                                         Please, specify 'sampling_frequency' parameter.")
-                    es = list(nwbfile.acquisition.values())[0]
-                else:
-                    es = electrical_series
-                # get rate
-                if es.rate is not None:
-                    self._sampling_frequency = es.rate
-                else:
-                    self._sampling_frequency = 1 / (es.timestamps[1] - es.timestamps[0])
+        # the file is kept open for the lifetime of the extractor, so that spike trains are read without reloading it
+        self._io = NWBHDF5IO(self._path, 'r')
+        nwbfile = self._io.read()
+        self._nwbfile = nwbfile
+        if sampling_frequency is None:
+            # defines the electrical series from where the sorting came from
+            # important to know the sampling_frequency
+            if electrical_series is None:
+                if len(nwbfile.acquisition) > 1:
+                    raise Exception('More than one acquisition found. You must specify electrical_series.')
+                if len(nwbfile.acquisition) == 0:
+                    raise Exception("No acquisitions found in the .nwb file from which to read sampling frequency. \
+                                     Please, specify 'sampling_frequency' parameter.")
+                es = list(nwbfile.acquisition.values())[0]
             else:
-                self._sampling_frequency = sampling_frequency
-
-            # get all units ids
-            units_ids = nwbfile.units.id[:]
-
-            # store units properties and spike features to dictionaries
-            all_pr_ft = list(nwbfile.units.colnames)
-            all_names = [i.name for i in nwbfile.units.columns]
-            for item in all_pr_ft:
-                if item == 'spike_times':
-                    continue
-                # test if item is a unit_property or a spike_feature
-                if item + '_index' in all_names:  # if it has index, it is a spike_feature
-                    for u_id in units_ids:
-                        ind = list(units_ids).index(u_id)
-                        self.set_unit_spike_features(u_id, item, nwbfile.units[item][ind])
-                else:  # if it is unit_property
-                    for u_id in units_ids:
-                        ind = list(units_ids).index(u_id)
-                        if isinstance(nwbfile.units[item][ind], pd.DataFrame):
-                            prop_value = nwbfile.units[item][ind].index[0]
-                        else:
-                            prop_value = nwbfile.units[item][ind]
-
-                        if isinstance(prop_value, (list, np.ndarray)):
+                es = electrical_series
+            # get rate
+            if es.rate is not None:
+                self._sampling_frequency = es.rate
+            else:
+                self._sampling_frequency = 1 / (es.timestamps[1] - es.timestamps[0])
+        else:
+            self._sampling_frequency = sampling_frequency
+
+        # get all units ids
+        units_ids = nwbfile.units.id[:]
+        self._unit_id_to_row = {int(u_id): i for i, u_id in enumerate(units_ids)}
+
+        # spike trains are read from the flat spike_times dataset, using the offsets of spike_times_index
+        self._spike_times = nwbfile.units['spike_times'].target.data
+        self._spike_times_index = np.asarray(nwbfile.units['spike_times'].data[:])
+        # whether the spike train of each unit row is sorted, filled when the train is first read
+        self._sorted_spike_trains = {}
+
+        # store units properties and spike features to dictionaries
+        all_pr_ft = list(nwbfile.units.colnames)
+        all_names = set(i.name for i in nwbfile.units.columns)
+        for item in all_pr_ft:
+            if item == 'spike_times':
+                continue
+            # test if item is a unit_property or a spike_feature
+            if item + '_index' in all_names:  # if it has index, it is a spike_feature
+                feature_index = nwbfile.units[item]
+                if type(feature_index.target) is VectorData:
+                    # split the flat feature values by unit
+                    item_values = np.split(np.asarray(feature_index.target.data[:]),
+                                           np.asarray(feature_index.data[:-1]))
+                else:  # e.g. doubly ragged features or regions of a referenced table (electrodes)
+                    item_values = feature_index[:]
+                for ind, u_id in enumerate(units_ids):
+                    self.set_unit_spike_features(u_id, item, item_values[ind])
+            else:  # if it is unit_property
+                item_values = nwbfile.units[item][:]
+                if isinstance(item_values, pd.DataFrame):
+                    # rows of a referenced table (e.g. electrodes): keep their ids
+                    item_values = item_values.index
+                for ind, u_id in enumerate(units_ids):
+                    prop_value = item_values[ind]
+
+                    if isinstance(prop_value, (list, np.ndarray)):
+                        self.set_unit_property(u_id, item, prop_value)
+                    else:
+                        if prop_value == prop_value:  # not nan
                             self.set_unit_property(u_id, item, prop_value)
-                        else:
-                            if prop_value == prop_value:  # not nan
-                                self.set_unit_property(u_id, item, prop_value)
-
-            # Fill epochs dictionary
-            self._epochs = {}
-            if nwbfile.epochs is not None:
-                df_epochs = nwbfile.epochs.to_dataframe()
-                self._epochs = {row['tags'][0]: {
-                    'start_frame': self.time_to_frame(row['start_time']),
-                    'end_frame': self.time_to_frame(row['stop_time'])}
-                    for _, row in df_epochs.iterrows()}
+
+        # Fill epochs dictionary
+        self._epochs = {}
+        if nwbfile.epochs is not None:
+            start_frames = self.time_to_frame(np.asarray(nwbfile.epochs['start_time'][:]))
+            end_frames = self.time_to_frame(np.asarray(nwbfile.epochs['stop_time'][:]))
+            self._epochs = {tags[0]: {
+                'start_frame': start_frame,
+                'end_frame': end_frame}
+                for tags, start_frame, end_frame in zip(nwbfile.epochs['tags'][:], start_frames, end_frames)}
         self._kwargs = {'file_path': str(Path(file_path).absolute()), 'electrical_series': electrical_series,
                         'sampling_frequency': sampling_frequency}
 
@@ -1215,23 +1593,58 @@ class NwbSortingExtractor(se.SortingExtractor):
             A list of the unit ids in the sorted result (ints).
         """
         check_nwb_install()
-        with NWBHDF5IO(self._path, 'r') as io:
-            nwbfile = io.read()
-            unit_ids = [int(i) for i in nwbfile.units.id[:]]
+        unit_ids = list(self._unit_id_to_row.keys())
         return unit_ids
 
     @check_get_unit_spike_train
     def get_unit_spike_train(self, unit_id, start_frame=None, end_frame=None):
 
         check_nwb_install()
-        with NWBHDF5IO(self._path, 'r') as io:
-            nwbfile = io.read()
-            # chosen unit and interval
-            times = nwbfile.units['spike_times'][list(nwbfile.units.id[:]).index(unit_id)][:]
-            # spike times are measured in samples
-            frames = self.time_to_frame(times)
+        # chosen unit and interval
+        row = self._unit_id_to_row[unit_id]
+        start = 0 if row == 0 else self._spike_times_index[row - 1]
+        times = self._spike_times[start:self._spike_times_index[row]]
+        if row not in self._sorted_spike_trains:
+            self._sorted_spike_trains[row] = bool(np.all(times[1:] >= times[:-1]))
+        # spike times are measured in samples
+        frames = self.time_to_frame(times)
+        if self._sorted_spike_trains[row]:
+            # sorted trains are cut to the interval with a binary search
+            return frames[np.searchsorted(frames, start_frame, side='right'):
+                          np.searchsorted(frames, end_frame, side='left')]
         return frames[(frames > start_frame) & (frames < end_frame)]
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+        # the extractor can be partially built, e.g. if unpickling failed
+        if hasattr(self, '_memmap_files'):
+            se.SortingExtractor.__del__(self)
+
+    def __getstate__(self):
+        # the h5py objects cannot be pickled: they are reopened from the file path when unpickling
+        state = self.__dict__.copy()
+        for key in ['_io', '_nwbfile', '_spike_times']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._io = NWBHDF5IO(self._kwargs['file_path'], 'r')
+        self._nwbfile = self._io.read()
+        self._spike_times = self._nwbfile.units['spike_times'].target.data
+
+    def close(self):
+        """Close the NWB file kept open by the extractor."""
+        if getattr(self, '_io', None) is not None:
+            self._io.close()
+            self._io = None
+
     @staticmethod
     def write_units(
             sorting: se.SortingExtractor,
@@ -1370,7 +1783,7 @@ class NwbSortingExtractor(se.SortingExtractor):
                         skip_features.append(ft)
                         break
 
-            nspikes = {k: get_nspikes(nwbfile.units, int(k)) for k in unit_ids}
+            nspikes = get_nspikes(nwbfile.units)
 
             for ft in feature_shapes.keys():
                 # skip first dimension (num_spikes) when comparing feature shape
@@ -1378,6 +1791,7 @@ class NwbSortingExtractor(se.SortingExtractor):
                     print(f"Skipping feature '{ft}' because it has variable size across units.")
                     skip_features.append(ft)
 
+            unit_id_to_index = {int(id): i for i, id in enumerate(nwbfile.units.id[:])}
             for ft in set(all_features) - set(skip_features):
                 values = []
                 if not ft.endswith('_idxs'):
@@ -1394,9 +1808,11 @@ class NwbSortingExtractor(se.SortingExtractor):
                             # all_feat_vals[feature_idxs] = feat_vals
                         else:
                             all_feat_vals = feat_vals
-                        values.append(all_feat_vals)
+                        values.append(np.asarray(all_feat_vals))
+                    if ft in skip_features:
+                        continue
 
-                    flatten_vals = [item for sublist in values for item in sublist]
+                    flatten_vals = np.concatenate(values)
                     nspks_list = [sp for sp in nspikes.values()]
                     spikes_index = np.cumsum(nspks_list).astype('int64')
                     if ft in nwbfile.units:  # If property already exists, skip it
@@ -1408,6 +1824,7 @@ class NwbSortingExtractor(se.SortingExtractor):
                         property_name=ft,
                         values=flatten_vals,
                         index=spikes_index,
+                        id_to_index=unit_id_to_index
                     )
         else:
             warnings.warn("The nwbfile already contains units. These units will not be over-written.")
@@ -1,13 +1,18 @@
 import os
+import pickle
 import shutil
 import tempfile
+import threading
 import unittest
+from copy import deepcopy
 from pathlib import Path
 
 import numpy as np
 
 import spikeextractors as se
 from spikeextractors.exceptions import NotDumpableExtractorError
+from spikeextractors.extractors.nwbextractors.nwbextractors import (HAVE_HDF5PLUGIN, HAVE_ZARR, TracesChunkIterator,
+    get_nspikes, most_relevant_ch)
 from spikeextractors.testing import (check_sortings_equal, check_recordings_equal, check_dumping,
     check_recording_return_types, check_sorting_return_types, get_default_nwbfile_metadata)
 
@@ -487,17 +492,16 @@ class TestExtractors(unittest.TestCase):
     def test_nwb_extractor(self):
         path1 = self.test_dir + '/test.nwb'
         se.NwbRecordingExtractor.write_recording(self.RX, path1)
-        RX_nwb = se.NwbRecordingExtractor(path1)
-        check_recording_return_types(RX_nwb)
-        check_recordings_equal(self.RX, RX_nwb)
-        check_dumping(RX_nwb)
+        with se.NwbRecordingExtractor(path1) as RX_nwb:
+            check_recording_return_types(RX_nwb)
+            check_recordings_equal(self.RX, RX_nwb)
+            check_dumping(RX_nwb)
 
-        del RX_nwb
         se.NwbRecordingExtractor.write_recording(recording=self.RX, save_path=path1, overwrite=True)
-        RX_nwb = se.NwbRecordingExtractor(path1)
-        check_recording_return_types(RX_nwb)
-        check_recordings_equal(self.RX, RX_nwb)
-        check_dumping(RX_nwb)
+        with se.NwbRecordingExtractor(path1) as RX_nwb:
+            check_recording_return_types(RX_nwb)
+            check_recordings_equal(self.RX, RX_nwb)
+            check_dumping(RX_nwb)
 
         # append sorting to existing file
         se.NwbSortingExtractor.write_sorting(sorting=self.SX, save_path=path1, overwrite=False)
@@ -505,9 +509,9 @@ class TestExtractors(unittest.TestCase):
         path2 = self.test_dir + "/firings_true.nwb"
         se.NwbRecordingExtractor.write_recording(recording=self.RX, save_path=path2)
         se.NwbSortingExtractor.write_sorting(sorting=self.SX, save_path=path2)
-        SX_nwb = se.NwbSortingExtractor(path2)
-        check_sortings_equal(self.SX, SX_nwb)
-        check_dumping(SX_nwb)
+        with se.NwbSortingExtractor(path2) as SX_nwb:
+            check_sortings_equal(self.SX, SX_nwb)
+            check_dumping(SX_nwb)
 
         # Test for handling unit property descriptions argument
         property_descriptions = dict(stability="This is a description of stability.")
@@ -517,9 +521,9 @@ class TestExtractors(unittest.TestCase):
             save_path=path1,
             property_descriptions=property_descriptions
         )
-        SX_nwb = se.NwbSortingExtractor(path1)
-        check_sortings_equal(self.SX, SX_nwb)
-        check_dumping(SX_nwb)
+        with se.NwbSortingExtractor(path1) as SX_nwb:
+            check_sortings_equal(self.SX, SX_nwb)
+            check_dumping(SX_nwb)
 
         # Test for handling skip_properties argument
         se.NwbRecordingExtractor.write_recording(recording=self.RX, save_path=path1, overwrite=True)
@@ -528,10 +532,10 @@ class TestExtractors(unittest.TestCase):
             save_path=path1,
             skip_properties=['stability']
         )
-        SX_nwb = se.NwbSortingExtractor(path1)
-        assert 'stability' not in SX_nwb.get_shared_unit_property_names()
-        check_sortings_equal(self.SX, SX_nwb)
-        check_dumping(SX_nwb)
+        with se.NwbSortingExtractor(path1) as SX_nwb:
+            assert 'stability' not in SX_nwb.get_shared_unit_property_names()
+            check_sortings_equal(self.SX, SX_nwb)
+            check_dumping(SX_nwb)
 
         # Test for handling skip_features argument
         se.NwbRecordingExtractor.write_recording(recording=self.RX, save_path=path1, overwrite=True)
@@ -542,10 +546,10 @@ class TestExtractors(unittest.TestCase):
             skip_features=['widths'],
             use_times=False
         )
-        SX_nwb = se.NwbSortingExtractor(path1)
-        assert 'widths' not in SX_nwb.get_shared_unit_spike_feature_names()
-        check_sortings_equal(self.SX2, SX_nwb)
-        check_dumping(SX_nwb)
+        with se.NwbSortingExtractor(path1) as SX_nwb:
+            assert 'widths' not in SX_nwb.get_shared_unit_spike_feature_names()
+            check_sortings_equal(self.SX2, SX_nwb)
+            check_dumping(SX_nwb)
 
         # Test writting multiple recordings using metadata
         metadata = get_default_nwbfile_metadata()
@@ -572,14 +576,183 @@ class TestExtractors(unittest.TestCase):
             es_key='ElectricalSeries_lfp',
         )
 
-        RX_nwb = se.NwbRecordingExtractor(
-            file_path=path_nwb,
-            electrical_series_name='raw_traces'
-        )
-        check_recording_return_types(RX_nwb)
-        check_recordings_equal(self.RX, RX_nwb)
-        check_dumping(RX_nwb)
-        del RX_nwb
+        with se.NwbRecordingExtractor(file_path=path_nwb, electrical_series_name='raw_traces') as RX_nwb:
+            check_recording_return_types(RX_nwb)
+            check_recordings_equal(self.RX, RX_nwb)
+            check_dumping(RX_nwb)
+
+    def test_nwb_extractor_file_lifetime(self):
+        path1 = self.test_dir + '/test.nwb'
+        se.NwbRecordingExtractor.write_recording(self.RX, path1)
+        se.NwbSortingExtractor.write_sorting(self.SX, path1, skip_properties=['stability'])
+        RX_nwb = se.NwbRecordingExtractor(path1)
+        SX_nwb = se.NwbSortingExtractor(path1)
+
+        # pickled and copied extractors reopen the file
+        for RX_copy in [pickle.loads(pickle.dumps(RX_nwb)), deepcopy(RX_nwb)]:
+            check_recordings_equal(self.RX, RX_copy)
+            RX_copy.close()
+        for SX_copy in [pickle.loads(pickle.dumps(SX_nwb)), deepcopy(SX_nwb)]:
+            check_sortings_equal(self.SX, SX_copy)
+            SX_copy.close()
+
+        # close() releases the file, which can then be overwritten
+        RX_nwb.close()
+        SX_nwb.close()
+        se.NwbRecordingExtractor.write_recording(self.RX3, path1, overwrite=True)
+        with se.NwbRecordingExtractor(path1) as RX_nwb:
+            check_recordings_equal(self.RX3, RX_nwb)
+
+    def test_nwb_most_relevant_ch(self):
+        waveforms = np.random.RandomState(seed=0).normal(0, 1, (50, 8, 30))
+        waveforms[:, 5, 10] -= 20
+        avg = np.mean(waveforms, axis=0)
+        max_min = [avg[ch, :].max() - avg[ch, :].min() for ch in range(waveforms.shape[1])]
+        assert most_relevant_ch(waveforms) == np.argmax(max_min) == 5
+
+    def test_nwb_traces_chunk_iterator(self):
+        X = np.random.RandomState(seed=0).normal(0, 100, (4, 1000)).astype('int16')
+        RX = se.NumpyRecordingExtractor(timeseries=X, sampling_frequency=30000)
+        unsigned_coercion = np.zeros(4)
+        num_threads = threading.active_count()
+
+        # all chunks
+        iterator = TracesChunkIterator(RX, 300, unsigned_coercion, write_scaled=False)
+        assert iterator.dtype == np.dtype('int16')
+        assert iterator.maxshape == (1000, 4)
+        assert iterator.recommended_chunk_shape() == (300, 4)
+        chunks = list(iterator)
+        assert [chunk.selection[0] for chunk in chunks] == [slice(0, 300), slice(300, 600), slice(600, 900),
+                                                            slice(900, 1000)]
+        assert np.array_equal(np.concatenate([chunk.data for chunk in chunks]), X.T)
+        assert threading.active_count() == num_threads
+
+        # early close stops the reader
+        iterator = TracesChunkIterator(RX, 10, unsigned_coercion, write_scaled=False)
+        assert np.array_equal(next(iterator).data, X[:, :10].T)
+        iterator.close()
+        assert threading.active_count() == num_threads
+        with self.assertRaises(StopIteration):
+            next(iterator)
+
+        # reader errors are raised to the consumer
+        class FailingRecording(se.NumpyRecordingExtractor):
+            def get_traces(self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True):
+                if start_frame is not None and start_frame >= 500:
+                    raise RuntimeError("read failed")
+                return super().get_traces(channel_ids=channel_ids, start_frame=start_frame, end_frame=end_frame,
+                                          return_scaled=return_scaled)
+
+        iterator = TracesChunkIterator(FailingRecording(timeseries=X, sampling_frequency=30000), 300,
+                                       unsigned_coercion, write_scaled=False)
+        with self.assertRaisesRegex(RuntimeError, "read failed"):
+            list(iterator)
+        assert threading.active_count() == num_threads
+
+    def test_nwb_extractor_channel_subsets(self):
+        path1 = self.test_dir + '/test.nwb'
+        X = np.random.RandomState(seed=0).normal(0, 100, (8, 1000)).astype('int16')
+        RX = se.SubRecordingExtractor(se.NumpyRecordingExtractor(timeseries=X, sampling_frequency=30000),
+                                      renamed_channel_ids=[10, 11, 12, 13, 14, 15, 16, 17])
+        se.NwbRecordingExtractor.write_recording(RX, path1)
+        with se.NwbRecordingExtractor(path1) as RX_nwb:
+            assert RX_nwb.get_channel_ids() == [10, 11, 12, 13, 14, 15, 16, 17]
+            # dense, out of order, sparse and sparse out of order channel subsets
+            for channel_ids in [[12, 13, 14], [14, 12, 13], [10, 16], [17, 11, 14]]:
+                assert np.array_equal(RX_nwb.get_traces(channel_ids=channel_ids, start_frame=100, end_frame=600),
+                                      X[np.array(channel_ids) - 10, 100:600])
+            # empty selections, also after removing invalid channel ids
+            for channel_ids in [[], [0, 1]]:
+                assert RX_nwb.get_traces(channel_ids=channel_ids, start_frame=100, end_frame=600).shape == (0, 500)
+
+    def test_nwb_extractor_spike_train_intervals(self):
+        path1 = self.test_dir + '/test.nwb'
+        SX = se.NumpySortingExtractor()
+        SX.set_sampling_frequency(30000)
+        SX.add_unit(unit_id=1, times=np.asarray([10, 20, 30, 40, 50]))
+        SX.add_unit(unit_id=2, times=np.asarray([50, 10, 40, 20, 30]))
+        se.NwbSortingExtractor.write_sorting(SX, path1, use_times=False)
+        with se.NwbSortingExtractor(path1, sampling_frequency=30000) as SX_nwb:
+            # sorted and unsorted trains exclude spikes on the start_frame and end_frame bounds
+            for unit_id in [1, 2]:
+                assert np.array_equal(SX_nwb.get_unit_spike_train(unit_id), SX.get_unit_spike_train(unit_id))
+                assert np.array_equal(SX_nwb.get_unit_spike_train(unit_id, start_frame=20, end_frame=40), [30])
+            assert np.array_equal(SX_nwb.get_unit_spike_train(2, start_frame=15, end_frame=45), [40, 20, 30])
+            assert get_nspikes(SX_nwb._nwbfile.units) == {1: 5, 2: 5}
+            assert get_nspikes(SX_nwb._nwbfile.units, 2) == 5
+
+    def test_nwb_extractor_units_electrodes(self):
+        from datetime import datetime
+        from pynwb import NWBFile, NWBHDF5IO
+
+        path1 = self.test_dir + '/test.nwb'
+        nwbfile = NWBFile(session_description='units with electrodes', identifier='id',
+                          session_start_time=datetime(1970, 1, 1))
+        device = nwbfile.create_device(name='device')
+        group = nwbfile.create_electrode_group(name='0', description='group', location='unknown', device=device)
+        for electrode_id in [10, 11, 12, 13]:
+            nwbfile.add_electrode(id=electrode_id, x=0., y=0., z=0., imp=0., location='unknown', filtering='none',
+                                  group=group)
+        nwbfile.add_unit(id=5, spike_times=[0.1, 0.2], electrodes=[0, 1])
+        nwbfile.add_unit(id=6, spike_times=[0.3], electrodes=[2])
+        with NWBHDF5IO(path1, 'w') as io:
+            io.write(nwbfile)
+        with se.NwbSortingExtractor(path1, sampling_frequency=30000) as SX_nwb:
+            # the electrodes region of each unit refers to the electrodes table rows
+            assert list(SX_nwb.get_unit_spike_features(5, 'electrodes').index) == [10, 11]
+            assert list(SX_nwb.get_unit_spike_features(6, 'electrodes').index) == [12]
+
+    def test_nwb_extractor_quantized(self):
+        path1 = self.test_dir + '/test.nwb'
+        gain = 0.195
+        X = np.random.RandomState(seed=0).normal(0, 100, (4, 10000)).astype('float32')
+        RX = se.NumpyRecordingExtractor(timeseries=X, sampling_frequency=30000)
+        RX.set_channel_gains(gain)
+        for write_scaled in [True, False]:
+            se.NwbRecordingExtractor.write_recording(RX, path1, overwrite=True, write_scaled=write_scaled,
+                                                     dtype='int16')
+            with se.NwbRecordingExtractor(path1) as RX_nwb:
+                assert RX_nwb._es_data.dtype == np.int16
+                assert np.allclose(RX_nwb.get_channel_gains(), gain)
+                if write_scaled:
+                    # float traces are quantized in steps of the channel gains
+                    assert np.max(np.abs(RX_nwb.get_traces() - RX.get_traces(return_scaled=True))) <= gain / 2 + 1e-4
+                else:
+                    assert np.max(np.abs(RX_nwb.get_traces(return_scaled=False) - X)) <= 0.5 + 1e-4
+
+        # out of range samples are not clipped
+        X[0, 10] = 40000 * gain
+        with self.assertRaises(ValueError):
+            se.NwbRecordingExtractor.write_recording(RX, path1, overwrite=True, write_scaled=True, dtype='int16')
+
+    @unittest.skipIf(not HAVE_HDF5PLUGIN, "hdf5plugin is not installed")
+    def test_nwb_extractor_blosc2(self):
+        import hdf5plugin
+
+        path1 = self.test_dir + '/test.nwb'
+        se.NwbRecordingExtractor.write_recording(self.RX, path1, compression='blosc2')
+        with se.NwbRecordingExtractor(path1) as RX_nwb:
+            assert RX_nwb._es_data.id.get_create_plist().get_filter(0)[0] == hdf5plugin.Blosc2.filter_id
+            check_recordings_equal(self.RX, RX_nwb)
+
+    @unittest.skipIf(not HAVE_ZARR, "zarr is not installed")
+    def test_nwb_extractor_zarr(self):
+        import zarr
+
+        path1 = self.test_dir + '/test.zarr'
+        se.NwbRecordingExtractor.write_recording(self.RX, path1)
+        es_group = zarr.open(path1, mode='r')['acquisition/ElectricalSeries_raw']
+        assert np.array_equal(es_group['data'][:], self.RX.get_traces().T)
+        assert es_group.attrs['rate'] == self.RX.get_sampling_frequency()
+        assert es_group.attrs['electrodes'] == self.RX.get_channel_ids()
+
+        with self.assertRaises(zarr.errors.ContainsGroupError):
+            se.NwbRecordingExtractor.write_recording(self.RX, path1)
+        with self.assertWarns(UserWarning):
+            se.NwbRecordingExtractor.write_recording(self.RX, path1, overwrite=True, write_as='lfp')
+        se.NwbRecordingExtractor.write_recording_zarr(self.RX, path1, overwrite=True, n_jobs=2)
+        assert np.array_equal(zarr.open(path1, mode='r')['acquisition/ElectricalSeries_raw/data'][:],
+                              self.RX.get_traces().T)
 
     def test_nixio_extractor(self):
         path1 = os.path.join(self.test_dir, 'raw.nix')